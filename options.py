@@ -1,13 +1,33 @@
-from argparse import Namespace
+import json
+import pickle
+import sys
 from pathlib import Path
 from typing import Any, Self
 
 import yaml
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from yaml import CSafeLoader as _SafeLoader
+except ImportError:
+    from yaml import SafeLoader as _SafeLoader
+
+try:
+    from yaml import CSafeDumper as _SafeDumper
+except ImportError:
+    from yaml import SafeDumper as _SafeDumper
+
+# types that serialize as they are, everything else is str()-ed
+_SAFE = frozenset({bool, int, float, str, list, tuple, type(None)})
+
 
 # TODO: separate a FlatDict class.
-class Opt(Namespace):
-    """[L]iftoff[O]ptions is a Namespace with support for:
+class Opt:
+    """[L]iftoff[O]ptions is a Namespace-like object with support for:
     - loading and saving `yaml`
     - convert to and from `dict` and flat `dict`
     - very pretty printing
@@ -16,22 +36,32 @@ class Opt(Namespace):
     """
 
     def __init__(self, **kwargs: Any) -> None:
-        super().__init__(**kwargs)
+        self.__dict__.update(kwargs)
+
+    def __repr__(self) -> str:
+        args = ", ".join(f"{k}={v!r}" for k, v in self.__dict__.items())
+        return f"Opt({args})"
+
+    def __getattr__(self, name: str) -> Any:
+        # `a` is a lazy alias for a `_`-suffixed key `a_`, so that argument
+        # passing like `f(**opt.field)` keeps working without storing the
+        # same value twice (see `from_dict`).
+        try:
+            return self.__dict__[name + "_"]
+        except KeyError:
+            raise AttributeError(name) from None
 
     @staticmethod
     def from_dict(d: dict) -> "Opt":
         """Recursive conversion of a dict in a LiftOpt.
-        Both `a` and `a_` keys are added tot the Namespace:
-            - `a` to to facilitate argument passing like `f(**opt.field)`.
-            - `a_` is required to allow casting to dict and flat dict.
+        Only the original key is stored, `a_` included; the stripped alias
+        `a` is resolved on the fly by `__getattr__`.
         """
         lopt = Opt()
         for key, value in d.items():
-            name = key.rstrip("_")
             if isinstance(value, dict) and not key.endswith("_"):
-                setattr(lopt, name, Opt.from_dict(value))
+                setattr(lopt, key, Opt.from_dict(value))
             else:
-                setattr(lopt, name, value)
                 setattr(lopt, key, value)
         return lopt
 
@@ -40,12 +70,18 @@ class Opt(Namespace):
         Key `a` is evicted if `a_` exists.
         """
         d = self if d is None else d
+        if not any(key.endswith("_") for key in d.__dict__):
+            # common case: no `_`-suffixed keys, so nothing to evict
+            return {
+                key: self.to_dict(value) if isinstance(value, Opt) else value
+                for key, value in d.__dict__.items()
+            }
         dct: dict = {}
         for key, value in d.__dict__.items():
             skey = key.rstrip("_")
             if skey in dct:
                 dct.pop(skey)
-            if isinstance(value, Namespace):
+            if isinstance(value, Opt):
                 dct[key] = self.to_dict(value)
             else:
                 dct[key] = value
@@ -74,20 +110,26 @@ class Opt(Namespace):
                     'steps': 1000
             }}}
         """
-        exp_dict = {}
+        root = Opt()
         for key, value in flat_dict.items():
-            if "." in key:
-                keys = key.split(".")
-                key_ = keys.pop(0)
-                if key_ not in exp_dict:
-                    exp_dict[key_] = Opt._expand_from_keys(keys, value)
+            keys = key.split(".")
+            # the cursor is an Opt, or a plain dict below a `_` key
+            node = root
+            for key_ in keys[:-1]:
+                if isinstance(node, dict):
+                    node = node.setdefault(key_, {})
                 else:
-                    exp_dict[key_] = Opt._recursive_update(
-                        exp_dict[key_], Opt._expand_from_keys(keys, value)
-                    )
+                    child = node.__dict__.get(key_)
+                    if child is None:
+                        child = {} if key_.endswith("_") else Opt()
+                        setattr(node, key_, child)
+                    node = child
+            leaf = keys[-1]
+            if isinstance(node, dict):
+                node[leaf] = value
             else:
-                exp_dict[key] = value
-        return Opt.from_dict(exp_dict)
+                setattr(node, leaf, value)
+        return root
 
     def to_flat_dict(self) -> dict:
         d = self.to_dict()
@@ -96,72 +138,119 @@ class Opt(Namespace):
     def from_yaml(path: str | Path) -> "Opt":
         """Read a config file and return a namespace."""
         with open(path) as handler:
-            config_data = yaml.load(handler, Loader=yaml.SafeLoader)
+            config_data = yaml.load(handler, Loader=_SafeLoader)
         return Opt.from_dict(config_data)
 
+    def from_yaml_cached(path: str | Path) -> "Opt":
+        """Like `from_yaml`, but keeps a pickled sidecar of the parsed config.
+
+        As long as the yaml file is older than its `.pkl` sidecar the
+        parse is skipped entirely, which matters when sweeps are resumed
+        over and over with `--append`.
+        """
+        path = Path(path)
+        cache = path.with_suffix(".pkl")
+        if cache.exists() and cache.stat().st_mtime >= path.stat().st_mtime:
+            with open(cache, "rb") as handler:
+                return pickle.load(handler)
+        opt = Opt.from_yaml(path)
+        with open(cache, "wb") as handler:
+            pickle.dump(opt, handler, protocol=pickle.HIGHEST_PROTOCOL)
+        return opt
+
     def to_yaml(self, path: str | Path) -> None:
         d = Opt.sanitize_dict(self.to_dict())
         # TODO: figure out how to sanitize it.
         with open(Path(path), "w") as outfile:
-            yaml.safe_dump(d, outfile, default_flow_style=False)
+            yaml.dump(d, outfile, Dumper=_SafeDumper, default_flow_style=False)
+
+    def to_json(self, path: str | Path) -> None:
+        """Faster alternative to `to_yaml` for machine-written snapshots."""
+        d = Opt.sanitize_dict(self.to_dict())
+        if orjson is not None:
+            Path(path).write_bytes(
+                orjson.dumps(d, default=str, option=orjson.OPT_INDENT_2)
+            )
+        else:
+            with open(Path(path), "w") as outfile:
+                json.dump(d, outfile, indent=2, default=str)
 
     @staticmethod
     def sanitize_dict(d: dict) -> dict:
+        """Coerce non-serializable values to `str`.
+
+        Returns `d` itself when the whole subtree is already safe, so the
+        common case makes no copies at all.
+        """
         d_ = {}
+        dirty = False
         for k, v in d.items():
             if isinstance(v, dict):
-                d_[k] = Opt.sanitize_dict(v)
-            # ugly...
-            elif not isinstance(v, (bool, int, float, str, list, tuple, dict)):
-                d_[k] = str(v)
-            else:
+                v_ = Opt.sanitize_dict(v)
+                dirty = dirty or v_ is not v
+                d_[k] = v_
+            elif type(v) in _SAFE:
                 d_[k] = v
-        return d_
+            else:
+                d_[k] = str(v)
+                dirty = True
+        return d_ if dirty else d
 
     @staticmethod
-    def _flatten_dict(d: dict, prev_key: str = None) -> dict:
-        """Recursive flatten a dict. Eg.: `{a: {ab: 0}}` -> `{a.ab: 0}`."""
+    def _flatten_dict(d: dict) -> dict:
+        """Iterative flatten of a dict. Eg.: `{a: {ab: 0}}` -> `{a.ab: 0}`."""
         flat_dct: dict = {}
-        for key, value in d.items():
-            new_key = f"{prev_key}.{key}" if prev_key is not None else key
-            if isinstance(value, dict):
-                flat_dct.update(Opt._flatten_dict(value, prev_key=new_key))
-            else:
-                flat_dct[new_key] = value
+        stack = [("", d)]
+        while stack:
+            prefix, dct = stack.pop()
+            for key, value in dct.items():
+                new_key = f"{prefix}.{key}" if prefix else key
+                if isinstance(value, dict):
+                    stack.append((new_key, value))
+                else:
+                    # the same dotted keys recur every trial, interning
+                    # caches their hash and enables identity lookups
+                    flat_dct[sys.intern(new_key)] = value
         return flat_dct
 
     @staticmethod
     def _expand_from_keys(keys: list, value: object) -> dict:
         """Expand [a, b c] to {a: {b: {c: value}}}"""
         dct = d = {}
-        while keys:
-            key = keys.pop(0)
-            d[key] = {} if keys else value
+        last = len(keys) - 1
+        for i, key in enumerate(keys):
+            d[key] = {} if i < last else value
             d = d[key]
         return dct
 
     @staticmethod
-    def _recursive_update(d: dict, u: dict) -> dict:
-        "Recursively update `d` with stuff in `u`."
+    def _merge(d: dict, u: dict) -> dict:
+        """Non-mutating `dict.update`, recursing into nested dicts.
+
+        Only the paths touched by `u` are copied, the rest of `d` is
+        shared, so cached dicts can be safely merged into per trial.
+        """
+        if not u:
+            return d
+        merged = dict(d)
         for k, v in u.items():
             if isinstance(v, dict):
-                d[k] = Opt._recursive_update(d.get(k, {}), v)
+                merged[k] = Opt._merge(d.get(k, {}), v)
             else:
-                d[k] = v
-        return d
+                merged[k] = v
+        return merged
 
     @staticmethod
-    def _to_str(lopt: Self, indent: int = 0):
-        s = ""
+    def _to_str(lopt: Self, indent: int = 0) -> str:
+        parts = []
+        pad = " " * indent
         for key, value in lopt.__dict__.items():
-            if key.endswith("_"):
-                continue
-            s += f"{key:>{len(key) + indent}s}: "
+            key = key.rstrip("_")
             if isinstance(value, Opt):
-                s += f"\n{Opt._to_str(value, indent + 2)}"
+                parts.append(f"{pad}{key}:\n{Opt._to_str(value, indent + 2)}")
             else:
-                s += f"{value}\n"
-        return s
+                parts.append(f"{pad}{key}: {value}")
+        return "\n".join(parts)
 
     def __str__(self):
         return Opt._to_str(self)
@@ -174,7 +263,6 @@ def main():
         "c": {"ca": 1, "cb": 2, "cc": 3, "cd": {"cda_": 1, "cdb": {"x": 99, "y": 100}}},
     }
     opt = Opt.from_dict(d)
-    print(isinstance(opt, Namespace))
     print(opt)
     print(repr(opt))
 
@@ -1,3 +1,5 @@
+import logging
+import sys
 from argparse import ArgumentParser, Namespace
 from datetime import datetime
 from functools import partial
@@ -8,6 +10,8 @@ import optuna
 
 from options import Opt
 
+logger = logging.getLogger(__name__)
+
 
 def run(opt: Opt, cb: Callable[[int, dict], None]) -> None:
     """Function containing your training code.
@@ -28,57 +32,87 @@ def run(opt: Opt, cb: Callable[[int, dict], None]) -> None:
 
 def runner(
     trial: optuna.Trial,
-    base_hp: Opt,
-    tune_hp: Opt,
+    flat_base: dict,
+    suggesters: list,
     metric_name: str = "acc",
 ) -> float:
     """The function called by `optuna.optimize`.
     For flexibility
     """
-    opt = suggest_config(trial, base_hp, tune_hp)
-    # set paths and save config
-    opt.out_dir.mkdir(exist_ok=True, parents=True)
-    opt.to_yaml(opt.out_dir / "cfg.yaml")
+    opt = suggest_config(trial, flat_base, suggesters)
+    # set paths and save config; the parent was already created in `main`,
+    # only the trial dir is new
+    opt.out_dir.mkdir(exist_ok=True)
+    opt.to_json(opt.out_dir / "cfg.json")
+
+    # bind the methods once, the callback runs every epoch of every trial
+    _set_attr = trial.set_user_attr
+    _report = trial.report
+    _should_prune = trial.should_prune
 
     def report_and_prune(step: int, metrics: dict) -> None:
-        trial.set_user_attr("last_score", metrics[metric_name])
-        trial.report(metrics[metric_name], step)
-        if trial.should_prune():
+        score = metrics[metric_name]
+        _set_attr("last_score", score)
+        _report(score, step)
+        if _should_prune():
             raise optuna.TrialPruned()
 
     run(opt, cb=report_and_prune)
     return trial.user_attrs["last_score"]
 
 
-def suggest_config(trial: optuna.Trial, base_hp: Opt, tune_hp: Opt) -> Opt:
-    """Takes a base config and a search space, querries optuna for trial
-    hyperparameters and returns a full trial config.
+def make_suggesters(flat_tune: dict) -> list:
+    """Binds each entry of the search space to its `trial.suggest_*` call.
+
+    Done once per study, so per-trial suggestion is a plain loop over
+    closures with no kind-dispatch or argument unpacking left in it.
     """
-    flat_base: dict = base_hp.to_flat_dict()
-    flat_tune: dict = tune_hp.to_flat_dict()
-    candidate: dict = {}
-    for k, v in flat_tune.items():
-        kind, args = v
+    suggesters = []
+    for k, (kind, args) in flat_tune.items():
+        k = sys.intern(k)
         if kind == "int":
             low, high, step, log = args
-            candidate[k] = trial.suggest_int(k, low, high, step=step, log=log)
+
+            def fn(trial, k=k, low=low, high=high, step=step, log=log):
+                return trial.suggest_int(k, low, high, step=step, log=log)
+
         elif kind == "float":
             low, high, step, log = args
-            candidate[k] = trial.suggest_float(k, low, high, step=step, log=log)
+
+            def fn(trial, k=k, low=low, high=high, step=step, log=log):
+                return trial.suggest_float(k, low, high, step=step, log=log)
+
         elif kind == "categorical":
-            candidate[k] = trial.suggest_categorical(k, args)
+
+            def fn(trial, k=k, args=args):
+                return trial.suggest_categorical(k, args)
+
         else:
             raise ValueError(f"trial.suggest not implemented for kind `{kind}`.")
-    print(candidate)
-    trial_opt = Opt.from_flat_dict(Opt._recursive_update(flat_base, candidate))
-    print(trial_opt)
+        suggesters.append((k, fn))
+    return suggesters
+
+
+def suggest_config(trial: optuna.Trial, flat_base: dict, suggesters: list) -> Opt:
+    """Takes a flattened base config and pre-bound suggesters, querries
+    optuna for trial hyperparameters and returns a full trial config.
+
+    The flat dict and suggesters are computed once in `main` since they
+    are invariant across trials.
+    """
+    candidate: dict = {k: fn(trial) for k, fn in suggesters}
+    trial_opt = Opt.from_flat_dict(Opt._merge(flat_base, candidate))
+    if logger.isEnabledFor(logging.DEBUG):
+        # stringifying the full config tree is not free, keep it gated
+        logger.debug("candidate: %s", candidate)
+        logger.debug("trial config:\n%s", trial_opt)
     trial_opt.out_dir = trial_opt.out_dir / f"trial_{trial.number:04d}"
     return trial_opt
 
 
 def main(opt: Namespace) -> None:
-    base_hp = Opt.from_yaml(Path(opt.config_root) / "base.yaml")
-    tune_hp = Opt.from_yaml(Path(opt.config_root) / "tune.yaml")
+    base_hp = Opt.from_yaml_cached(Path(opt.config_root) / "base.yaml")
+    tune_hp = Opt.from_yaml_cached(Path(opt.config_root) / "tune.yaml")
 
     if opt.append:
         assert (
@@ -91,14 +125,16 @@ def main(opt: Namespace) -> None:
     # make the trial aware of the output directory
     base_hp.out_dir = Path.cwd() / opt.results_dir / search_name
     base_hp.out_dir.mkdir(exist_ok=True, parents=True)
+    # flatten and bind the search space once, both invariant across trials
+    flat_base = base_hp.to_flat_dict()
+    suggesters = make_suggesters(tune_hp.to_flat_dict())
     # create the objective
-    objective = partial(runner, base_hp=base_hp, tune_hp=tune_hp)
+    objective = partial(runner, flat_base=flat_base, suggesters=suggesters)
 
-    storage = optuna.storages.RDBStorage(
-        url=f"sqlite:///{opt.results_dir}/optuna.db",
-        # heartbeat_interval=60,
-        # grace_period=600,
-        # failed_trial_callback=optuna.storages.RetryFailedTrialCallback(max_retry=3),
+    # journal storage appends instead of locking a sqlite db, so parallel
+    # workers don't contend on every trial.report/should_prune
+    storage = optuna.storages.JournalStorage(
+        optuna.storages.journal.JournalFileBackend(f"{opt.results_dir}/optuna.log")
     )
 
     study = optuna.create_study(
@@ -113,6 +149,7 @@ def main(opt: Namespace) -> None:
 
     study.optimize(
         objective,
+        n_jobs=opt.n_jobs,
         callbacks=[
             optuna.study.MaxTrialsCallback(
                 opt.max_trials,
@@ -127,6 +164,7 @@ if __name__ == "__main__":
     parser = ArgumentParser("TuneRL")
     parser.add_argument("config_root", type=str)
     parser.add_argument("--max-trials", dest="max_trials", type=int)
+    parser.add_argument("--n-jobs", dest="n_jobs", default=1, type=int)
     parser.add_argument(
         "--results-dir", dest="results_dir", default="results", type=str
     )